@@ -1,6 +1,7 @@
 from __future__ import annotations
 import re
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Hashable
 from dataclasses import dataclass
 
 from github.pull_request import PullRequest
@@ -21,6 +22,11 @@ class Issue:
         issue_body = payload["body"]
         return cls(number=issue_number, title=issue_title, body=issue_body)
 
+    @property
+    def key(self) -> Hashable:
+        # New issues do not have a number yet, they are identified by title.
+        return self.number if self.number else self.title
+
     def link_pull_request(self, pull_request: PullRequest) -> None:
         self.linked_pull_request = pull_request
 
@@ -52,9 +58,10 @@ async def parse_issues(
     issues = []
     issue_pattern = r'(?:close(?:\b|s|d)|fix(?:\b|es|ed)|resolve(?:\b|s|d)) #[0-9]+'
     matches = re.findall(issue_pattern, pull_request.body)
-    for match in matches:
-        issue_number = match.split("#")[1]
-        issue_payload = await github_manager.get_issue(number=issue_number)
+    issues_payloads = await asyncio.gather(*[
+        github_manager.get_issue(number=match.split("#")[1])
+        for match in matches])
+    for issue_payload in issues_payloads:
         issue = Issue.from_dict(payload=issue_payload)
         issue.link_pull_request(pull_request=pull_request)
         issues.append(issue)
@@ -1,11 +1,20 @@
 from __future__ import annotations
 import json
+import asyncio
 from aiohttp.client import ClientSession
-from typing import List, Dict, TYPE_CHECKING
+from typing import (
+    List, Dict, Any, Awaitable, Hashable, Optional, TYPE_CHECKING)
 
+from plan import count_request
+from scheduler import RequestScheduler
+from single_flight import SingleFlight
+from write_buffer import WriteBuffer
 if TYPE_CHECKING:
     from github.issue import Issue
 
+PAGE_SIZE = 100
+MAX_ATTEMPTS = 3
+
 
 class GitHubManager:
 
@@ -13,8 +22,17 @@ class GitHubManager:
                  session: ClientSession,
                  repo: str,
                  owner: str,
-                 token: str) -> None:
+                 token: str,
+                 scheduler: RequestScheduler = None,
+                 cache_ttl: float = None) -> None:
         self.session = session
+        self.scheduler = scheduler or RequestScheduler()
+        self.single_flight = SingleFlight(ttl=cache_ttl)
+        # Issues sharing a key are the same issue, the latest body wins.
+        self.issue_buffer: WriteBuffer[Issue] = WriteBuffer(
+            merge=lambda issue, other: other,
+            write=self._write_issue)
+        self._create_lock = asyncio.Lock()
         self.base_url = f"https://api.github.com/repos/{owner}/{repo}/"
         self.headers = {
             "Authorization": token,
@@ -22,15 +40,53 @@ class GitHubManager:
             "Content-Type": "application/json"
         }
 
+    async def _request(self,
+                       method: str,
+                       url: str,
+                       data: str = None,
+                       idempotent: bool = None) -> Any:
+        if idempotent is None:
+            idempotent = method == "GET"
+        if not idempotent:
+            self.single_flight.invalidate()
+            return await self._send(method, url, data=data)
+        # Identical concurrent reads share a single request.
+        return await self.single_flight.do(
+            key=(method, url, data),
+            factory=lambda: self._send(method, url, data=data))
+
+    async def _send(self, method: str, url: str, data: str = None) -> Any:
+        for attempt in range(MAX_ATTEMPTS):
+            count_request(service="github")
+            async with self.scheduler.slot():
+                async with self.session.request(
+                        method, url, headers=self.headers,
+                        data=data) as response:
+                    self.scheduler.update_rate_limit(response.headers)
+                    # Rate limited requests pause the whole scheduler, then
+                    # are retried.
+                    if (response.status == 429
+                            and attempt < MAX_ATTEMPTS - 1):
+                        self.scheduler.pause(
+                            float(response.headers.get("Retry-After", 1)))
+                        continue
+                    response.raise_for_status()
+                    return await response.json()
+
     async def get_issue(self, number: int) -> Dict:
         url = self.base_url + f"issues/{number}"
-        async with self.session.get(url, headers=self.headers) as response:
-            return await response.json()
+        return await self._request("GET", url)
 
     async def get_all_issues(self) -> List[Dict]:
-        url = self.base_url + "issues"
-        async with self.session.get(url, headers=self.headers) as response:
-            return await response.json()
+        issues = []
+        page = 1
+        while True:
+            url = self.base_url + f"issues?per_page={PAGE_SIZE}&page={page}"
+            payloads = await self._request("GET", url)
+            issues.extend(payloads)
+            if len(payloads) < PAGE_SIZE:
+                return issues
+            page += 1
 
     async def post_issue(self, issue: Issue) -> None:
         url = self.base_url + "issues"
@@ -38,18 +94,48 @@ class GitHubManager:
             "title": issue.title,
             "body": issue.body
         })
-        async with self.session.post(url, headers=self.headers, data=data) as response:
-            response.raise_for_status()
+        await self._request("POST", url, data=data)
 
     async def update_issue(self, issue: Issue) -> None:
         url = self.base_url + f"issues/{issue.number}"
         data = json.dumps({
             "body": issue.body
         })
-        async with self.session.patch(url, headers=self.headers, data=data) as response:
-            response.raise_for_status()
+        await self._request("PATCH", url, data=data)
 
     async def get_reviews(self, number: int) -> Dict:
         url = self.base_url + f"pulls/{number}/reviews"
-        async with self.session.get(url, headers=self.headers) as response:
-            return await response.json()
+        return await self._request("GET", url)
+
+    async def get_updated_pull_requests(
+            self, since: Optional[str] = None) -> List[Dict]:
+        # Pull requests are listed from the most recently updated one, so the
+        # pagination stops at the first pull request older than the watermark.
+        pull_requests = []
+        page = 1
+        while True:
+            url = self.base_url + (
+                f"pulls?state=all&sort=updated&direction=desc"
+                f"&per_page={PAGE_SIZE}&page={page}")
+            payloads = await self._request("GET", url)
+            for payload in payloads:
+                if since is not None and payload["updated_at"] < since:
+                    return pull_requests
+                pull_requests.append(payload)
+            if len(payloads) < PAGE_SIZE:
+                return pull_requests
+            page += 1
+
+    async def _write_issue(self, issue: Issue) -> None:
+        if issue.number:
+            await self.update_issue(issue=issue)
+        else:
+            async with self._create_lock:
+                await self.post_issue(issue=issue)
+
+    def queue_issue(self, issue: Issue, version: Any = 0) -> Hashable:
+        self.issue_buffer.add(key=issue.key, value=issue, version=version)
+        return issue.key
+
+    def flush(self) -> Awaitable[Dict[Hashable, Exception]]:
+        return self.issue_buffer.flush()
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from enum import Enum
 
 
@@ -21,17 +21,27 @@ class PullRequest:
     body: str
     status: PullRequestStatus
     reviews: List[Review]
+    updated_at: str = ""
+
+    @property
+    def order_key(self) -> Tuple[str, int]:
+        return self.updated_at, self.number
 
     @classmethod
     async def from_event(cls, event: Dict, manager: GitHubManager) -> PullRequest:
-        action = event["action"]
-        pull_request_payload = event["pull_request"]
+        return await cls.from_payload(
+            pull_request_payload=event["pull_request"], manager=manager)
 
+    @classmethod
+    async def from_payload(cls,
+                           pull_request_payload: Dict,
+                           manager: GitHubManager) -> PullRequest:
         number = pull_request_payload["number"]
         link = pull_request_payload["html_url"]
-        body = pull_request_payload.get("body", "")
-        if action == "closed":
-            if pull_request_payload["merged"]:
+        body = pull_request_payload.get("body") or ""
+        if pull_request_payload["state"] == "closed":
+            # Listed pull requests only have the merge date.
+            if pull_request_payload.get("merged_at") is not None:
                 status = PullRequestStatus.MERGED
             else:
                 status = PullRequestStatus.CLOSED
@@ -62,5 +72,6 @@ class PullRequest:
         reviews = [Review(author=author, state=state)
                    for author, state in reviews_params.items()]
         pull_request = cls(
-            number=number, link=link, body=body, status=status, reviews=reviews)
+            number=number, link=link, body=body, status=status, reviews=reviews,
+            updated_at=pull_request_payload["updated_at"])
         return pull_request
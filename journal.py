@@ -0,0 +1,87 @@
+from __future__ import annotations
+import os
+import json
+from typing import Dict, Hashable, Optional, Set, Tuple
+
+
+class SyncError(Exception):
+
+    def __init__(self, failures: Dict[Hashable, Exception]) -> None:
+        self.failures = failures
+        super().__init__(
+            f"{len(failures)} items failed to sync: "
+            + ", ".join(f"{key} ({error!r})"
+                        for key, error in failures.items()))
+
+
+# Number of runs after which a generation ends even if items still fail.
+MAX_ATTEMPTS = 3
+
+
+class SyncJournal:
+
+    def __init__(self,
+                 path: str,
+                 generation: int = 0,
+                 attempts: int = 0,
+                 completed: Set[Tuple[str, ...]] = None,
+                 max_attempts: int = MAX_ATTEMPTS,
+                 watermark: Optional[str] = None) -> None:
+        self.path = path
+        self.generation = generation
+        self.attempts = attempts
+        # Items are versioned, e.g. (page id, last edited time), so that an
+        # item edited since it was completed is synced again.
+        self.completed = completed if completed is not None else set()
+        self.max_attempts = max_attempts
+        # Syncs listing items by update date only list the ones updated since
+        # the watermark.
+        self.watermark = watermark
+
+    @classmethod
+    def load(cls, path: str, max_attempts: int = MAX_ATTEMPTS) -> SyncJournal:
+        if not os.path.exists(path):
+            return cls(path=path, max_attempts=max_attempts)
+        with open(path) as journal_file:
+            journal_dict = json.load(journal_file)
+        return cls(
+            path=path,
+            generation=journal_dict["generation"],
+            attempts=journal_dict["attempts"],
+            completed={tuple(item) for item in journal_dict["completed"]},
+            max_attempts=max_attempts,
+            watermark=journal_dict["watermark"])
+
+    def save(self) -> None:
+        # The journal is replaced atomically so that an interrupted run never
+        # leaves a truncated file behind.
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as journal_file:
+            json.dump({
+                "generation": self.generation,
+                "attempts": self.attempts,
+                "completed": sorted(list(item) for item in self.completed),
+                "watermark": self.watermark
+            }, journal_file)
+        os.replace(temporary_path, self.path)
+
+    def is_completed(self, item: Tuple[str, ...]) -> bool:
+        return item in self.completed
+
+    def complete(self, item: Tuple[str, ...]) -> None:
+        self.completed.add(item)
+
+    def finish_run(self, failed: bool) -> None:
+        # Items failing on every run must not prevent the other items from
+        # being synced again, the generation ends after max_attempts runs.
+        self.attempts += 1
+        if not failed or self.attempts >= self.max_attempts:
+            self.next_generation()
+
+    def next_generation(self) -> None:
+        self.generation += 1
+        self.attempts = 0
+        self.completed = set()
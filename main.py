@@ -2,23 +2,55 @@ import json
 import argparse
 import asyncio
 import aiohttp
-from typing import Dict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 
 from github.pull_request import PullRequest
 from github.issue import Issue, parse_issues, create_unique_issues_from_payloads
 from github.manager import GitHubManager
-from notion.ticket import Ticket, update_ticket_from_issue
+from notion.ticket import (
+    RenderedTicket, latest_pages_by_title, plan_tickets_from_issues,
+    render_tickets_in_pool)
 from notion.manager import NotionManager
+from scheduler import Priority, run_with_priority
+from journal import SyncError, SyncJournal
+from plan import (
+    ActionType, IssueAction, SyncPlan, counting_requests, execute_plan)
+
+GITHUB_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Pull requests reconciled by the first reconciliation, without watermark.
+INITIAL_LOOKBACK = timedelta(days=7)
 
 
 async def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--event")
+    parser.add_argument(
+        "--reconciliation-interval", type=float, default=None,
+        help="Seconds between two full Notion to GitHub reconciliations. "
+             "Runs a single reconciliation if not set.")
+    parser.add_argument(
+        "--journal", default=None,
+        help="Path of the journal checkpointing the reconciliation, a failed "
+             "reconciliation then resumes with the unfinished or edited "
+             "pages.")
+    parser.add_argument(
+        "--reconcile-pull-requests", default=None, metavar="JOURNAL",
+        help="Also update the tickets of every pull request updated since the "
+             "watermark of the journal stored at this path.")
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Print the plan of each sync and its estimated requests without "
+             "writing anything.")
+    parser.add_argument(
+        "--parse-workers", type=int, default=None,
+        help="Number of processes parsing the pages of the reconciliation. "
+             "Pages are parsed on the event loop if not set.")
     args = parser.parse_args()
 
-    event_payload = json.loads(args.event)
-    print(json.dumps(event_payload, indent=4))
-
+    executor = (ProcessPoolExecutor(max_workers=args.parse_workers)
+                if args.parse_workers is not None else None)
     async with aiohttp.ClientSession() as session:
         github_manager = GitHubManager(
             session=session,
@@ -30,55 +62,297 @@ async def main():
             database_id=...,
             token=...)
 
-        await notion_to_github_sync(
-            notion_manager=notion_manager, github_manager=github_manager)
-        await github_to_notion_sync(
-            event_payload=event_payload, github_manager=github_manager,
-            notion_manager=notion_manager)
+        syncs = [
+            run_with_priority(
+                Priority.BACKGROUND,
+                reconciliation_loop(
+                    interval=args.reconciliation_interval,
+                    journal=(SyncJournal.load(path=args.journal)
+                             if args.journal is not None else None),
+                    notion_manager=notion_manager,
+                    github_manager=github_manager,
+                    dry_run=args.dry_run,
+                    executor=executor))
+        ]
+        if args.reconcile_pull_requests is not None:
+            syncs.append(run_with_priority(
+                Priority.BACKGROUND,
+                github_to_notion_reconciliation(
+                    journal_path=args.reconcile_pull_requests,
+                    github_manager=github_manager,
+                    notion_manager=notion_manager,
+                    dry_run=args.dry_run)))
+        if args.event is not None:
+            event_payload = json.loads(args.event)
+            print(json.dumps(event_payload, indent=4))
+            # Event syncs are latency sensitive, their requests go before the
+            # ones of the background reconciliation.
+            syncs.append(run_with_priority(
+                Priority.EVENT,
+                github_to_notion_sync(
+                    event_payload=event_payload, github_manager=github_manager,
+                    notion_manager=notion_manager, dry_run=args.dry_run)))
+        try:
+            # A failing reconciliation must not cancel the event sync, errors
+            # are raised once every sync is done.
+            results = await asyncio.gather(*syncs, return_exceptions=True)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors[1:]:
+        print(error)
+    if errors:
+        raise errors[0]
 
 
-async def sync_page(page: Dict,
-                    unique_issues: Dict[str, Issue],
-                    notion_manager: NotionManager,
-                    github_manager: GitHubManager) -> None:
-    page_id = page["id"]
-    page_content = await notion_manager.get_page_content(page_id=page_id)
-    ticket = Ticket.from_page(page=page, body=page_content)
-    title = ticket.title
-    body = ticket.create_issue_body()
+async def reconciliation_loop(interval: Optional[float],
+                              notion_manager: NotionManager,
+                              github_manager: GitHubManager,
+                              journal: SyncJournal = None,
+                              dry_run: bool = False,
+                              executor: Executor = None) -> None:
+    while True:
+        try:
+            await notion_to_github_sync(
+                notion_manager=notion_manager, github_manager=github_manager,
+                journal=journal, dry_run=dry_run, executor=executor)
+        except Exception as error:
+            # In server mode the next reconciliation retries the failed pages,
+            # including after errors which aborted the whole reconciliation
+            # (e.g. a failed database query).
+            if interval is None:
+                raise
+            print(f"Reconciliation failed: {error}")
+        if interval is None or dry_run:
+            break
+        await asyncio.sleep(interval)
+
+
+def plan_issue(rendered_ticket: RenderedTicket,
+               unique_issues: Dict[str, Issue],
+               last_edited_time: str) -> IssueAction:
+    title = rendered_ticket.title
+    body = rendered_ticket.issue_body
     if title in unique_issues:
         issue = unique_issues[title]
         updated = issue.update_body(body=body)
-        if updated:
-            await github_manager.update_issue(issue=issue)
+        action_type = ActionType.UPDATE if updated else ActionType.NOOP
     else:
         issue = Issue(number=0, title=title, body=body)
-        await github_manager.post_issue(issue=issue)
+        action_type = ActionType.CREATE
+    return IssueAction(
+        type=action_type, issue=issue, page_id=rendered_ticket.id,
+        last_edited_time=last_edited_time)
 
 
-async def notion_to_github_sync(
-        notion_manager: NotionManager, github_manager: GitHubManager):
-    pages = await notion_manager.get_pages()
+async def plan_notion_to_github(
+        notion_manager: NotionManager, github_manager: GitHubManager,
+        journal: SyncJournal = None, executor: Executor = None) -> SyncPlan:
+    # Only the winning page of a title is diffed against its issue, so that
+    # an older page never overwrites the issue of a newer one left as is.
+    pages = latest_pages_by_title(pages=await notion_manager.get_pages())
+    if journal is not None:
+        pages = [page for page in pages
+                 if not journal.is_completed(
+                     item=(page["id"], page["last_edited_time"]))]
     issues_payloads = await github_manager.get_all_issues()
     unique_issues = create_unique_issues_from_payloads(issues_payloads)
-    await asyncio.gather(*[
-        sync_page(
-            page=page, unique_issues=unique_issues,
-            notion_manager=notion_manager, github_manager=github_manager)
-        for page in pages])
+    # A failing page does not abort the other ones, failures are collected.
+    pages_contents = await asyncio.gather(*[
+        notion_manager.get_page_content(page_id=page["id"])
+        for page in pages], return_exceptions=True)
+    plan = SyncPlan()
+    payloads = []
+    for page, page_content in zip(pages, pages_contents):
+        if isinstance(page_content, Exception):
+            plan.failures[page["id"]] = page_content
+        else:
+            payloads.append((page, page_content))
+    rendered_tickets = await render_tickets_in_pool(
+        payloads=payloads, executor=executor)
+    for (page, _), rendered_ticket in zip(payloads, rendered_tickets):
+        if isinstance(rendered_ticket, Exception):
+            plan.failures[page["id"]] = rendered_ticket
+        else:
+            plan.issue_actions.append(plan_issue(
+                rendered_ticket=rendered_ticket, unique_issues=unique_issues,
+                last_edited_time=page["last_edited_time"]))
+    return plan
 
 
-async def github_to_notion_sync(
+async def notion_to_github_sync(
+        notion_manager: NotionManager, github_manager: GitHubManager,
+        journal: SyncJournal = None, dry_run: bool = False,
+        executor: Executor = None):
+    with counting_requests() as reads:
+        plan = await plan_notion_to_github(
+            notion_manager=notion_manager, github_manager=github_manager,
+            journal=journal, executor=executor)
+    plan.reads = dict(reads)
+    if dry_run:
+        print_plan(name="Notion to GitHub", plan=plan,
+                   github_manager=github_manager)
+        return
+    failures = dict(plan.failures)
+    failures.update(await execute_plan(
+        plan=plan, github_manager=github_manager,
+        notion_manager=notion_manager))
+
+    if journal is not None:
+        for action in plan.issue_actions:
+            if action.item not in failures:
+                journal.complete(item=action.checkpoint)
+        journal.finish_run(failed=bool(failures))
+        journal.save()
+    if failures:
+        raise SyncError(failures=failures)
+
+
+async def plan_github_to_notion(
         event_payload: Dict, github_manager: GitHubManager,
-        notion_manager: NotionManager):
+        notion_manager: NotionManager) -> SyncPlan:
     pull_request = await PullRequest.from_event(
         event=event_payload, manager=github_manager)
     issues = await parse_issues(
         pull_request=pull_request, github_manager=github_manager)
-    # Notion fetch tickets and update them.
-    await asyncio.gather(*[
-        update_ticket_from_issue(issue=issue, notion_manager=notion_manager)
-        for issue in issues])
+    return await plan_tickets_from_issues(
+        issues=issues, notion_manager=notion_manager)
+
+
+async def github_to_notion_sync(
+        event_payload: Dict, github_manager: GitHubManager,
+        notion_manager: NotionManager, dry_run: bool = False):
+    with counting_requests() as reads:
+        plan = await plan_github_to_notion(
+            event_payload=event_payload, github_manager=github_manager,
+            notion_manager=notion_manager)
+    plan.reads = dict(reads)
+    if dry_run:
+        print_plan(name="GitHub to Notion", plan=plan,
+                   github_manager=github_manager)
+        return
+    failures = dict(plan.failures)
+    failures.update(await execute_plan(
+        plan=plan, github_manager=github_manager,
+        notion_manager=notion_manager))
+    if failures:
+        raise SyncError(failures=failures)
+
+
+async def build_pull_request_issues(
+        pull_request_payload: Dict,
+        github_manager: GitHubManager) -> List[Issue]:
+    pull_request = await PullRequest.from_payload(
+        pull_request_payload=pull_request_payload, manager=github_manager)
+    return await parse_issues(
+        pull_request=pull_request, github_manager=github_manager)
+
+
+def pull_request_checkpoint(pull_request_payload: Dict) -> Tuple[str, str]:
+    return (str(pull_request_payload["number"]),
+            pull_request_payload["updated_at"])
+
+
+async def plan_pull_requests_reconciliation(
+        journal: SyncJournal, github_manager: GitHubManager,
+        notion_manager: NotionManager
+) -> Tuple[SyncPlan, List[Dict], Dict[Tuple[str, str], List[str]]]:
+    since = journal.watermark
+    if since is None:
+        since = (datetime.now(timezone.utc) - INITIAL_LOOKBACK).strftime(
+            GITHUB_DATE_FORMAT)
+    pull_requests_payloads = await github_manager.get_updated_pull_requests(
+        since=since)
+    pending_payloads = [
+        payload for payload in pull_requests_payloads
+        if not journal.is_completed(item=pull_request_checkpoint(payload))]
+    # A failing pull request does not abort the other ones.
+    results = await asyncio.gather(*[
+        build_pull_request_issues(
+            pull_request_payload=payload, github_manager=github_manager)
+        for payload in pending_payloads], return_exceptions=True)
+    issues = []
+    titles_by_checkpoint = {}
+    failures = {}
+    for payload, result in zip(pending_payloads, results):
+        checkpoint = pull_request_checkpoint(payload)
+        if isinstance(result, Exception):
+            failures[checkpoint] = result
+        else:
+            issues.extend(result)
+            titles_by_checkpoint[checkpoint] = [
+                issue.title for issue in result]
+    # Pull requests skipped by the journal still keep older ones from
+    # overriding the tickets they updated.
+    pull_requests_updates = {
+        payload["number"]: payload["updated_at"]
+        for payload in pull_requests_payloads}
+    plan = await plan_tickets_from_issues(
+        issues=issues, notion_manager=notion_manager,
+        pull_requests_updates=pull_requests_updates)
+    plan.failures.update(
+        (f"pull request #{number}", error)
+        for (number, _), error in failures.items())
+    return plan, pull_requests_payloads, titles_by_checkpoint
+
+
+async def github_to_notion_reconciliation(
+        journal_path: str, github_manager: GitHubManager,
+        notion_manager: NotionManager, dry_run: bool = False):
+    journal = SyncJournal.load(path=journal_path)
+    with counting_requests() as reads:
+        plan, pull_requests_payloads, titles_by_checkpoint = (
+            await plan_pull_requests_reconciliation(
+                journal=journal, github_manager=github_manager,
+                notion_manager=notion_manager))
+    plan.reads = dict(reads)
+    if dry_run:
+        print_plan(name="Pull requests reconciliation", plan=plan,
+                   github_manager=github_manager)
+        return
+    failures = dict(plan.failures)
+    failures.update(await execute_plan(
+        plan=plan, github_manager=github_manager,
+        notion_manager=notion_manager))
+
+    # Pull requests are checkpointed one by one, so that a rerun only
+    # replays the failed ones.
+    failed_updates = [
+        updated_at for (number, updated_at) in (
+            pull_request_checkpoint(payload)
+            for payload in pull_requests_payloads)
+        if f"pull request #{number}" in failures]
+    for checkpoint, titles in titles_by_checkpoint.items():
+        if any(title in failures for title in titles):
+            failed_updates.append(checkpoint[1])
+        else:
+            journal.complete(item=checkpoint)
+    # The watermark stops at the oldest failed pull request, unless it kept
+    # failing for max_attempts runs.
+    if failed_updates and journal.attempts + 1 < journal.max_attempts:
+        journal.watermark = min(failed_updates)
+    elif pull_requests_payloads:
+        journal.watermark = max(
+            payload["updated_at"] for payload in pull_requests_payloads)
+    journal.finish_run(failed=bool(failed_updates))
+    journal.save()
+    if failures:
+        raise SyncError(failures=failures)
+
+
+def print_plan(name: str, plan: SyncPlan,
+               github_manager: GitHubManager) -> None:
+    print(f"{name} plan:")
+    print(plan)
+    # Notion does not advertise its remaining quota, only GitHub's is known.
+    scheduler = github_manager.scheduler
+    if scheduler.rate_limit_remaining is not None:
+        budget = scheduler.rate_limit_remaining - scheduler.rate_limit_reserve
+        needed = plan.estimate()["github"]
+        fits = "fits" if needed <= budget else "does not fit"
+        print(f"A run needs {needed} GitHub requests, it {fits} in the "
+              f"{scheduler.rate_limit_remaining} remaining requests.")
 
 
 if __name__ == "__main__":
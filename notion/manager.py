@@ -1,17 +1,39 @@
 from __future__ import annotations
 import json
+import asyncio
 from aiohttp.client import ClientSession
-from typing import List, Dict, TYPE_CHECKING
+from typing import List, Dict, Any, Awaitable, Hashable, TYPE_CHECKING
+
+from plan import count_request
+from scheduler import RequestScheduler
+from single_flight import SingleFlight
+from write_buffer import WriteBuffer
 if TYPE_CHECKING:
     from notion.ticket import Ticket
 
+# Maximum number of conditions in a compound filter of a database query.
+FILTER_CONDITIONS_LIMIT = 100
+# Maximum number of results in a page of a paginated endpoint.
+PAGE_SIZE = 100
+# Notion allows an average of three requests per second per integration.
+REQUESTS_PER_SECOND = 3
+MAX_ATTEMPTS = 3
+
 
 class NotionManager:
     def __init__(self,
                  session: ClientSession,
                  database_id: str,
-                 token: str) -> None:
+                 token: str,
+                 scheduler: RequestScheduler = None,
+                 cache_ttl: float = None) -> None:
         self.session = session
+        self.scheduler = scheduler or RequestScheduler(
+            requests_per_second=REQUESTS_PER_SECOND)
+        self.single_flight = SingleFlight(ttl=cache_ttl)
+        self.ticket_buffer: WriteBuffer[Ticket] = WriteBuffer(
+            merge=lambda ticket, other: ticket.merge(other=other),
+            write=lambda ticket: self.post_ticket(ticket=ticket))
         self.database_id = database_id
         self.base_url = "https://api.notion.com/v1/"
         self.headers = {
@@ -20,6 +42,39 @@ class NotionManager:
             "Content-Type": "application/json"
         }
 
+    async def _request(self,
+                       method: str,
+                       url: str,
+                       data: str = None,
+                       idempotent: bool = None) -> Any:
+        if idempotent is None:
+            idempotent = method == "GET"
+        if not idempotent:
+            self.single_flight.invalidate()
+            return await self._send(method, url, data=data)
+        # Identical concurrent reads share a single request.
+        return await self.single_flight.do(
+            key=(method, url, data),
+            factory=lambda: self._send(method, url, data=data))
+
+    async def _send(self, method: str, url: str, data: str = None) -> Any:
+        for attempt in range(MAX_ATTEMPTS):
+            count_request(service="notion")
+            async with self.scheduler.slot():
+                async with self.session.request(
+                        method, url, headers=self.headers,
+                        data=data) as response:
+                    self.scheduler.update_rate_limit(response.headers)
+                    # Rate limited requests pause the whole scheduler, then
+                    # are retried.
+                    if (response.status == 429
+                            and attempt < MAX_ATTEMPTS - 1):
+                        self.scheduler.pause(
+                            float(response.headers.get("Retry-After", 1)))
+                        continue
+                    response.raise_for_status()
+                    return await response.json()
+
     async def post_ticket(self, ticket: Ticket) -> None:
         url = self.base_url + f"pages/{ticket.id}"
         data = json.dumps({
@@ -28,13 +83,25 @@ class NotionManager:
                 for ticket_property in ticket.properties
             }
         })
-        async with self.session.patch(url, headers=self.headers, data=data) as response:
-            response.raise_for_status()
+        await self._request("PATCH", url, data=data)
+
+    def queue_ticket(self, ticket: Ticket, version: Any = 0) -> Hashable:
+        self.ticket_buffer.add(key=ticket.id, value=ticket, version=version)
+        return ticket.id
+
+    def flush(self) -> Awaitable[Dict[Hashable, Exception]]:
+        return self.ticket_buffer.flush()
 
     async def get_pages(self, titles: List[str] = None) -> List[Dict]:
         url = self.base_url + f"databases/{self.database_id}/query"
+        if titles and len(titles) > FILTER_CONDITIONS_LIMIT:
+            batches = await asyncio.gather(*[
+                self.get_pages(
+                    titles=titles[start:start + FILTER_CONDITIONS_LIMIT])
+                for start in range(0, len(titles), FILTER_CONDITIONS_LIMIT)])
+            return [page for batch in batches for page in batch]
         if titles:
-            data = json.dumps({
+            query = {
                 "filter": {
                     "or": [
                         {
@@ -43,21 +110,40 @@ class NotionManager:
                         } for title in titles
                     ]
                 }
-            })
+            }
         else:
-            data = json.dumps({
+            query = {
                 "filter":
                     {
                         "property": "Status",
                         "select": {"does_not_equal": "Completed"}
                     }
-            })
-        async with self.session.post(url, headers=self.headers, data=data) as response:
-            json_response = await response.json()
-            return json_response["results"]
+            }
+        # A query returns at most a page of results, the next ones are
+        # requested from the cursor of the previous page.
+        pages = []
+        cursor = None
+        while True:
+            data = {**query, "page_size": PAGE_SIZE}
+            if cursor is not None:
+                data["start_cursor"] = cursor
+            json_response = await self._request(
+                "POST", url, data=json.dumps(data), idempotent=True)
+            pages.extend(json_response["results"])
+            if not json_response.get("has_more"):
+                return pages
+            cursor = json_response["next_cursor"]
 
     async def get_page_content(self, page_id: str) -> List[Dict]:
-        url = self.base_url + f"blocks/{page_id}/children"
-        async with self.session.get(url, headers=self.headers) as response:
-            json_response = await response.json()
-            return json_response["results"]
+        blocks = []
+        cursor = None
+        while True:
+            url = self.base_url + (
+                f"blocks/{page_id}/children?page_size={PAGE_SIZE}")
+            if cursor is not None:
+                url += f"&start_cursor={cursor}"
+            json_response = await self._request("GET", url)
+            blocks.extend(json_response["results"])
+            if not json_response.get("has_more"):
+                return blocks
+            cursor = json_response["next_cursor"]
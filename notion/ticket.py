@@ -1,17 +1,25 @@
 from __future__ import annotations
+import asyncio
+from concurrent.futures import Executor
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, TYPE_CHECKING
+from typing import List, Dict, Any, Optional, Tuple, Union, TYPE_CHECKING
 from enum import Enum
 
-from notion.property import Property, PROPERTY_TYPE_TO_SUBCLASS
+from notion.property import (
+    Property, TitleProperty, PROPERTY_TYPE_TO_SUBCLASS)
 from notion.block import Block, ParagraphBlock
 from notion.objects import RichText, Text
 from notion.manager import NotionManager
 from github.pull_request import PullRequestStatus
+from plan import ActionType, SyncPlan, TicketAction
 if TYPE_CHECKING:
     from github.issue import Issue
 
 
+# Number of pages rendered by a single executor task.
+RENDER_BATCH_SIZE = 200
+
+
 class TicketStatus(Enum):
     BACKLOG = "Backlog"
     BACKLOG_PRIO = "Backlog - prio"
@@ -73,6 +81,29 @@ class Ticket:
         ticket_property = self.get_property(name=name)
         ticket_property.update(value=value)
 
+    def merge(self, other: Ticket) -> Ticket:
+        if other.id != self.id:
+            raise ValueError("Cannot merge tickets of different pages.")
+        properties = {
+            ticket_property.name: ticket_property
+            for ticket_property in self.properties + other.properties
+        }
+        body = other.body if other.body else self.body
+        return Ticket(
+            id=self.id, properties=list(properties.values()), body=body)
+
+    @property
+    def linked_pull_request_number(self) -> Optional[int]:
+        pull_request_text = "".join(
+            f"{rich_text}"
+            for rich_text in self.get_property(name="PR number").value)
+        if not pull_request_text.startswith("#"):
+            return None
+        try:
+            return int(pull_request_text[1:])
+        except ValueError:
+            return None
+
     def update(self, issue: Issue) -> None:
         if issue.title != self.title:
             raise ValueError(
@@ -101,6 +132,13 @@ class Ticket:
             reviewers_text = []
         self.update_property(name="Reviewers", value=reviewers_text)
 
+    def changed_properties(self, original: Ticket) -> List[Property]:
+        return [
+            ticket_property for ticket_property in self.properties
+            if ticket_property.to_dict()
+            != original.get_property(name=ticket_property.name).to_dict()
+        ]
+
     def create_issue_body(self) -> str:
         tags = self.get_property(name="Task")
         issue_body = ["".join(f"[{tag}]" for tag in tags.value)]
@@ -114,10 +152,127 @@ class Ticket:
         return "\n".join(issue_body)
 
 
-async def update_ticket_from_issue(
-        issue: Issue, notion_manager: NotionManager) -> None:
-    pages = await notion_manager.get_pages(titles=[issue.title])
-    page = pages[0]
+def page_title(page: Dict) -> str:
+    name_property = TitleProperty.from_dict(
+        property_dict={"Name": page["properties"]["Name"]})
+    return name_property.value
+
+
+def latest_pages_by_title(pages: List[Dict]) -> List[Dict]:
+    # Pages sharing a title update the same issue, the last edited one wins.
+    # The page id breaks ties between pages edited in the same minute.
+    latest_pages = {}
+    for page in pages:
+        try:
+            key = page_title(page=page)
+        except Exception:
+            # Kept on their own, rendering reports why they cannot be read.
+            key = (page["id"],)
+        latest_page = latest_pages.get(key)
+        if (latest_page is None
+                or (page["last_edited_time"], page["id"])
+                > (latest_page["last_edited_time"], latest_page["id"])):
+            latest_pages[key] = page
+    return list(latest_pages.values())
+
+
+@dataclass
+class RenderedTicket:
+    id: str
+    title: str
+    issue_body: str
+
+
+def render_ticket(page: Dict, body: List[Dict]) -> RenderedTicket:
+    ticket = Ticket.from_page(page=page, body=body)
+    return RenderedTicket(
+        id=ticket.id, title=ticket.title,
+        issue_body=ticket.create_issue_body())
+
+
+def render_tickets(
+        payloads: List[Tuple[Dict, List[Dict]]]
+) -> List[Union[RenderedTicket, Exception]]:
+    # A page which cannot be parsed does not fail the rest of its batch.
+    rendered_tickets = []
+    for page, body in payloads:
+        try:
+            rendered_tickets.append(render_ticket(page=page, body=body))
+        except Exception as error:
+            rendered_tickets.append(error)
+    return rendered_tickets
+
+
+async def render_tickets_in_pool(
+        payloads: List[Tuple[Dict, List[Dict]]],
+        executor: Executor = None,
+        batch_size: int = RENDER_BATCH_SIZE
+) -> List[Union[RenderedTicket, Exception]]:
+    if executor is None:
+        return render_tickets(payloads=payloads)
+    # Parsing and rendering large boards is CPU bound, batches are rendered
+    # in the executor so that the event loop keeps serving the requests.
+    loop = asyncio.get_running_loop()
+    batches = await asyncio.gather(*[
+        loop.run_in_executor(
+            executor, render_tickets, payloads[start:start + batch_size])
+        for start in range(0, len(payloads), batch_size)])
+    return [rendered_ticket
+            for batch in batches
+            for rendered_ticket in batch]
+
+
+def plan_ticket_update(
+        page: Dict,
+        issues: List[Issue],
+        pull_requests_updates: Dict[int, str] = None) -> TicketAction:
+    original = Ticket.from_page(page=page)
     ticket = Ticket.from_page(page=page)
-    ticket.update(issue=issue)
-    await notion_manager.post_ticket(ticket=ticket)
+    # The last updated pull request wins when several of them close the same
+    # issue, including the one already linked to the ticket if its update
+    # date is known.
+    linked_number = ticket.linked_pull_request_number
+    if pull_requests_updates and linked_number in pull_requests_updates:
+        linked_key = (pull_requests_updates[linked_number], linked_number)
+        issues = [issue for issue in issues
+                  if issue.linked_pull_request.order_key >= linked_key]
+    issues = sorted(
+        issues, key=lambda issue: issue.linked_pull_request.order_key)
+    for issue in issues:
+        ticket.update(issue=issue)
+    # Only the properties which really changed are sent.
+    changed_properties = ticket.changed_properties(original=original)
+    action_type = ActionType.UPDATE if changed_properties else ActionType.NOOP
+    return TicketAction(
+        type=action_type,
+        ticket=Ticket(id=ticket.id, properties=changed_properties),
+        title=ticket.title,
+        version=issues[-1].linked_pull_request.order_key if issues else 0)
+
+
+async def plan_tickets_from_issues(
+        issues: List[Issue],
+        notion_manager: NotionManager,
+        pull_requests_updates: Dict[int, str] = None) -> SyncPlan:
+    issues_by_title = {}
+    for issue in issues:
+        issues_by_title.setdefault(issue.title, []).append(issue)
+    plan = SyncPlan()
+    if not issues_by_title:
+        return plan
+    pages = await notion_manager.get_pages(titles=list(issues_by_title))
+    pages_by_title = {}
+    for page in pages:
+        ticket = Ticket.from_page(page=page)
+        pages_by_title.setdefault(ticket.title, page)
+    # Issues without a ticket on the board are ignored.
+    for title, title_issues in issues_by_title.items():
+        if title not in pages_by_title:
+            continue
+        try:
+            plan.ticket_actions.append(plan_ticket_update(
+                page=pages_by_title[title], issues=title_issues,
+                pull_requests_updates=pull_requests_updates))
+        except Exception as error:
+            plan.failures[title] = error
+    return plan
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import asyncio
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import (
+    Any, Dict, Hashable, Iterator, List, Optional, Tuple, TYPE_CHECKING)
+
+if TYPE_CHECKING:
+    from github.issue import Issue
+    from github.manager import GitHubManager
+    from notion.ticket import Ticket
+    from notion.manager import NotionManager
+
+request_counter: ContextVar[Optional[Counter]] = ContextVar(
+    "request_counter", default=None)
+
+
+def count_request(service: str) -> None:
+    counter = request_counter.get()
+    if counter is not None:
+        counter[service] += 1
+
+
+@contextmanager
+def counting_requests() -> Iterator[Counter]:
+    # Requests sent within the block, including by the tasks it spawns, are
+    # counted by service.
+    counter = Counter()
+    token = request_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        request_counter.reset(token)
+
+
+class ActionType(Enum):
+    CREATE = "create"
+    UPDATE = "update"
+    NOOP = "no-op"
+
+
+@dataclass
+class IssueAction:
+    type: ActionType
+    issue: Issue
+    page_id: str
+    last_edited_time: str
+
+    @property
+    def item(self) -> Hashable:
+        return self.page_id
+
+    @property
+    def version(self) -> Tuple[str, str]:
+        # The page id breaks ties between pages edited in the same minute.
+        return self.last_edited_time, self.page_id
+
+    @property
+    def checkpoint(self) -> Tuple[str, str]:
+        return self.page_id, self.last_edited_time
+
+    def __str__(self):
+        number = f"#{self.issue.number} " if self.issue.number else ""
+        return (f"{self.type.value} issue {number}'{self.issue.title}' "
+                f"from page {self.page_id}")
+
+
+@dataclass
+class TicketAction:
+    type: ActionType
+    ticket: Ticket
+    title: str
+    version: Any = 0
+
+    @property
+    def item(self) -> Hashable:
+        return self.title
+
+    def __str__(self):
+        properties = ", ".join(
+            ticket_property.name for ticket_property in self.ticket.properties)
+        changes = f" ({properties})" if properties else ""
+        return f"{self.type.value} ticket '{self.title}'{changes}"
+
+
+@dataclass
+class SyncPlan:
+    issue_actions: List[IssueAction] = field(default_factory=list)
+    ticket_actions: List[TicketAction] = field(default_factory=list)
+    # Items which could not be planned, by item.
+    failures: Dict[Hashable, Exception] = field(default_factory=dict)
+
+    # Requests sent to gather the state, by service.
+    reads: Dict[str, int] = field(default_factory=dict)
+
+    def estimate_writes(self) -> Dict[str, int]:
+        # Writes are coalesced per target, so each target costs one request.
+        github_targets = {
+            action.issue.key for action in self.issue_actions
+            if action.type != ActionType.NOOP}
+        notion_targets = {
+            action.ticket.id for action in self.ticket_actions
+            if action.type != ActionType.NOOP}
+        return {"github": len(github_targets), "notion": len(notion_targets)}
+
+    def estimate(self) -> Dict[str, int]:
+        # Cost of a whole run, reading the state then executing the plan.
+        writes = self.estimate_writes()
+        return {service: self.reads.get(service, 0) + writes[service]
+                for service in writes}
+
+    def __str__(self):
+        lines = [f"{action}"
+                 for action in self.issue_actions + self.ticket_actions]
+        lines.extend(f"failed to plan {item}: {error!r}"
+                     for item, error in self.failures.items())
+        writes = self.estimate_writes()
+        for service, name in (("github", "GitHub"), ("notion", "Notion")):
+            lines.append(
+                f"{name} requests: {self.reads.get(service, 0)} reads, "
+                f"{writes[service]} writes.")
+        return "\n".join(lines)
+
+
+async def execute_plan(
+        plan: SyncPlan, github_manager: GitHubManager,
+        notion_manager: NotionManager) -> Dict[Hashable, Exception]:
+    issue_keys = {}
+    for action in plan.issue_actions:
+        if action.type != ActionType.NOOP:
+            issue_keys[action.item] = github_manager.queue_issue(
+                issue=action.issue, version=action.version)
+    ticket_keys = {}
+    for action in plan.ticket_actions:
+        if action.type != ActionType.NOOP:
+            ticket_keys[action.item] = notion_manager.queue_ticket(
+                ticket=action.ticket, version=action.version)
+    # Each buffer sends a single request per target and both services are
+    # written concurrently, within the limits of their schedulers. GitHub
+    # issue creations are serialized by the manager, as GitHub asks for
+    # content creating requests to be sent one at a time.
+    github_failures, notion_failures = await asyncio.gather(
+        github_manager.flush(), notion_manager.flush())
+
+    failures = {}
+    for item, key in issue_keys.items():
+        if key in github_failures:
+            failures[item] = github_failures[key]
+    for item, key in ticket_keys.items():
+        if key in notion_failures:
+            failures[item] = notion_failures[key]
+    return failures
@@ -0,0 +1,187 @@
+from __future__ import annotations
+import os
+import json
+import argparse
+import asyncio
+import aiohttp
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple
+
+from github.manager import GitHubManager
+from notion.manager import NotionManager, REQUESTS_PER_SECOND
+from scheduler import (
+    BACKGROUND_CONCURRENCY, BURST, MAX_CONCURRENCY, Priority,
+    RequestScheduler, run_with_priority)
+from journal import SyncJournal
+from main import reconciliation_loop
+
+
+@dataclass
+class SyncPair:
+    database_id: str
+    notion_token: str
+    owner: str
+    repo: str
+    github_token: str
+
+    @classmethod
+    def from_dict(cls, pair_dict: Dict) -> SyncPair:
+        return cls(
+            database_id=pair_dict["database_id"],
+            notion_token=pair_dict["notion_token"],
+            owner=pair_dict["owner"],
+            repo=pair_dict["repo"],
+            github_token=pair_dict["github_token"])
+
+    @property
+    def journal_name(self) -> str:
+        return f"{self.database_id}-{self.owner}-{self.repo}.json"
+
+    def __str__(self):
+        return f"{self.database_id} <-> {self.owner}/{self.repo}"
+
+
+def load_pairs(path: str) -> List[SyncPair]:
+    with open(path) as config_file:
+        config = json.load(config_file)
+    return [SyncPair.from_dict(pair_dict=pair_dict)
+            for pair_dict in config["pairs"]]
+
+
+def shard_pairs(pairs: List[SyncPair], workers: int) -> List[List[SyncPair]]:
+    # Pairs are sorted by tokens then dealt round robin, so that the pairs of
+    # a token are spread evenly between the shards.
+    pairs = sorted(
+        pairs, key=lambda pair: (pair.github_token, pair.notion_token))
+    shards = [[] for _ in range(min(workers, len(pairs)))]
+    for index, pair in enumerate(pairs):
+        shards[index % len(shards)].append(pair)
+    return shards
+
+
+def count_token_shards(
+        shards: List[List[SyncPair]]) -> Dict[Tuple[str, str], int]:
+    token_shards = {}
+    for shard in shards:
+        tokens = {("github", pair.github_token) for pair in shard}
+        tokens.update(("notion", pair.notion_token) for pair in shard)
+        for token in tokens:
+            token_shards[token] = token_shards.get(token, 0) + 1
+    return token_shards
+
+
+def create_scheduler(service: str, shares: int) -> RequestScheduler:
+    # The budget of a token is split between the shards using it. The GitHub
+    # rate limit reserve is not, as every shard reads the remaining quota of
+    # the token from the response headers.
+    max_concurrency = max(1, MAX_CONCURRENCY // shares)
+    background_concurrency = max(1, BACKGROUND_CONCURRENCY // shares)
+    if service == "notion":
+        return RequestScheduler(
+            max_concurrency=max_concurrency,
+            background_concurrency=background_concurrency,
+            requests_per_second=REQUESTS_PER_SECOND / shares,
+            burst=max(1, BURST // shares))
+    return RequestScheduler(
+        max_concurrency=max_concurrency,
+        background_concurrency=background_concurrency)
+
+
+async def sync_shard(pairs: List[SyncPair],
+                     token_shards: Dict[Tuple[str, str], int],
+                     reconciliation_interval: Optional[float],
+                     journal_dir: Optional[str] = None) -> None:
+    schedulers = {}
+    for pair in pairs:
+        for token in (("github", pair.github_token),
+                      ("notion", pair.notion_token)):
+            if token not in schedulers:
+                schedulers[token] = create_scheduler(
+                    service=token[0], shares=token_shards[token])
+    async with aiohttp.ClientSession() as session:
+        syncs = []
+        for pair in pairs:
+            github_manager = GitHubManager(
+                session=session,
+                owner=pair.owner,
+                repo=pair.repo,
+                token=pair.github_token,
+                scheduler=schedulers[("github", pair.github_token)])
+            notion_manager = NotionManager(
+                session=session,
+                database_id=pair.database_id,
+                token=pair.notion_token,
+                scheduler=schedulers[("notion", pair.notion_token)])
+            if journal_dir is not None:
+                journal = SyncJournal.load(
+                    path=os.path.join(journal_dir, pair.journal_name))
+            else:
+                journal = None
+            syncs.append(run_with_priority(
+                Priority.BACKGROUND,
+                reconciliation_loop(
+                    interval=reconciliation_interval,
+                    notion_manager=notion_manager,
+                    github_manager=github_manager,
+                    journal=journal)))
+        # A failing pair must not stop the other pairs of the shard.
+        results = await asyncio.gather(*syncs, return_exceptions=True)
+    failed_pairs = []
+    for pair, result in zip(pairs, results):
+        if isinstance(result, Exception):
+            print(f"Sync of {pair} failed: {result!r}")
+            failed_pairs.append(pair)
+    # The error is sent back to the parent process, so it only carries the
+    # failed pairs rather than the original, possibly unpicklable, errors.
+    if failed_pairs:
+        raise RuntimeError(
+            f"{len(failed_pairs)} of {len(pairs)} pairs failed to sync: "
+            + ", ".join(f"{pair}" for pair in failed_pairs))
+
+
+def run_shard(pairs: List[SyncPair],
+              token_shards: Dict[Tuple[str, str], int],
+              reconciliation_interval: Optional[float],
+              journal_dir: Optional[str] = None) -> None:
+    asyncio.run(sync_shard(
+        pairs=pairs, token_shards=token_shards,
+        reconciliation_interval=reconciliation_interval,
+        journal_dir=journal_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--reconciliation-interval", type=float, default=None)
+    parser.add_argument("--journal-dir", default=None)
+    args = parser.parse_args()
+
+    pairs = load_pairs(path=args.config)
+    shards = shard_pairs(pairs=pairs, workers=args.workers)
+    if not shards:
+        return
+    token_shards = count_token_shards(shards=shards)
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [
+            executor.submit(
+                run_shard, shard, token_shards, args.reconciliation_interval,
+                args.journal_dir)
+            for shard in shards]
+        # Every shard runs to the end, then the first failure is raised so
+        # that the process exits with an error.
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as error:
+                errors.append(error)
+    for error in errors[1:]:
+        print(error)
+    if errors:
+        raise errors[0]
+
+
+if __name__ == "__main__":
+    main()
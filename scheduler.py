@@ -0,0 +1,149 @@
+from __future__ import annotations
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Optional, Mapping, Awaitable, TypeVar, AsyncIterator
+
+T = TypeVar("T")
+
+MAX_CONCURRENCY = 10
+BACKGROUND_CONCURRENCY = 5
+BURST = 3
+
+
+class Priority(IntEnum):
+    EVENT = 0
+    BACKGROUND = 1
+
+
+current_priority: ContextVar[Priority] = ContextVar(
+    "current_priority", default=Priority.EVENT)
+
+
+async def run_with_priority(priority: Priority, coroutine: Awaitable[T]) -> T:
+    # Tasks spawned by the coroutine (e.g. through asyncio.gather) copy the
+    # context, so every request they make inherits the priority.
+    token = current_priority.set(priority)
+    try:
+        return await coroutine
+    finally:
+        current_priority.reset(token)
+
+
+class RequestScheduler:
+
+    def __init__(self,
+                 max_concurrency: int = MAX_CONCURRENCY,
+                 background_concurrency: int = BACKGROUND_CONCURRENCY,
+                 rate_limit_reserve: int = 100,
+                 requests_per_second: float = None,
+                 burst: int = BURST,
+                 burst_reserve: int = 1) -> None:
+        self.max_concurrency = max_concurrency
+        self.background_concurrency = min(
+            background_concurrency, max_concurrency)
+        # Quota advertised by the X-RateLimit headers (GitHub).
+        self.rate_limit_reserve = rate_limit_reserve
+        self.rate_limit_remaining: Optional[int] = None
+        self.rate_limit_reset: Optional[float] = None
+        # Average rate limit without headers (Notion), as a token bucket of
+        # which the last burst_reserve tokens are kept for event requests.
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.burst_reserve = min(burst_reserve, burst - 1)
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        # Set by a 429 response, no request starts before it.
+        self.paused_until: Optional[float] = None
+        self._in_flight = 0
+        self._background_in_flight = 0
+        self._event_waiting = 0
+        self._condition = asyncio.Condition()
+
+    def update_rate_limit(self, headers: Mapping[str, str]) -> None:
+        remaining = headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            self.rate_limit_remaining = int(remaining)
+        reset = headers.get("X-RateLimit-Reset")
+        if reset is not None:
+            self.rate_limit_reset = float(reset)
+
+    def pause(self, seconds: float) -> None:
+        paused_until = time.time() + seconds
+        if self.paused_until is None or paused_until > self.paused_until:
+            self.paused_until = paused_until
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        refilled = (now - self._refilled_at) * self.requests_per_second
+        self._tokens = min(self.burst, self._tokens + refilled)
+        self._refilled_at = now
+
+    def _rate_limit_delay(self, priority: Priority) -> Optional[float]:
+        # Seconds to wait before the rate limit budget allows a request of
+        # this priority, None if it can start now.
+        delays = []
+        now = time.time()
+        if self.paused_until is not None and self.paused_until > now:
+            delays.append(self.paused_until - now)
+        if (priority == Priority.BACKGROUND
+                and self.rate_limit_remaining is not None
+                and self.rate_limit_remaining <= self.rate_limit_reserve
+                and self.rate_limit_reset is not None):
+            if self.rate_limit_reset > now:
+                delays.append(self.rate_limit_reset - now)
+            else:
+                self.rate_limit_remaining = None
+        if self.requests_per_second is not None:
+            self._refill()
+            required = (1 if priority == Priority.EVENT
+                        else 1 + self.burst_reserve)
+            if self._tokens < required:
+                delays.append(
+                    (required - self._tokens) / self.requests_per_second)
+        return max(delays) if delays else None
+
+    def _can_start(self, priority: Priority) -> bool:
+        if self._in_flight >= self.max_concurrency:
+            return False
+        if (priority == Priority.BACKGROUND
+                and (self._event_waiting > 0
+                     or self._background_in_flight
+                     >= self.background_concurrency)):
+            # Background requests only use the spare capacity.
+            return False
+        return self._rate_limit_delay(priority) is None
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        priority = current_priority.get()
+        async with self._condition:
+            if priority == Priority.EVENT:
+                self._event_waiting += 1
+            try:
+                while not self._can_start(priority):
+                    try:
+                        await asyncio.wait_for(
+                            self._condition.wait(),
+                            timeout=self._rate_limit_delay(priority))
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                if priority == Priority.EVENT:
+                    self._event_waiting -= 1
+                    self._condition.notify_all()
+            self._in_flight += 1
+            if priority == Priority.BACKGROUND:
+                self._background_in_flight += 1
+            if self.requests_per_second is not None:
+                self._tokens -= 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                if priority == Priority.BACKGROUND:
+                    self._background_in_flight -= 1
+                self._condition.notify_all()
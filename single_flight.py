@@ -0,0 +1,62 @@
+from __future__ import annotations
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from scheduler import Priority, current_priority
+
+
+class SingleFlight:
+
+    def __init__(self, ttl: Optional[float] = None) -> None:
+        self.ttl = ttl
+        self._in_flight: Dict[Hashable, Tuple[asyncio.Future, Priority]] = {}
+        self._memo: Dict[Hashable, Tuple[float, Any]] = {}
+        self._generation = 0
+
+    async def do(self,
+                 key: Hashable,
+                 factory: Callable[[], Awaitable[Any]]) -> Any:
+        if self.ttl is not None and key in self._memo:
+            expiry, result = self._memo[key]
+            if time.monotonic() < expiry:
+                return result
+            del self._memo[key]
+        priority = current_priority.get()
+        in_flight = self._in_flight.get(key)
+        # The shared request runs with the priority of the caller which
+        # started it. A more urgent caller does not wait behind a less urgent
+        # request, it starts its own one which later callers then join.
+        if in_flight is None or in_flight[1] > priority:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = (task, priority)
+            generation = self._generation
+            task.add_done_callback(
+                lambda done: self._complete(key, done, generation))
+        else:
+            task = in_flight[0]
+        # Cancelling one caller must not cancel the request shared with the
+        # other ones.
+        return await asyncio.shield(task)
+
+    def _complete(self,
+                  key: Hashable,
+                  task: asyncio.Future,
+                  generation: int) -> None:
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None and in_flight[0] is task:
+            del self._in_flight[key]
+        if task.cancelled():
+            return
+        # The exception is always retrieved, as every caller may have been
+        # cancelled.
+        error = task.exception()
+        # Results of requests started before an invalidation may be stale.
+        if (self.ttl is not None and generation == self._generation
+                and error is None):
+            self._memo[key] = (time.monotonic() + self.ttl, task.result())
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._in_flight.clear()
+        self._memo.clear()
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import asyncio
+from typing import (
+    Any, Awaitable, Callable, Dict, Generic, Hashable, List, Tuple, TypeVar)
+
+V = TypeVar("V")
+
+
+class WriteBuffer(Generic[V]):
+
+    def __init__(self,
+                 merge: Callable[[V, V], V],
+                 write: Callable[[V], Awaitable[None]]) -> None:
+        self.merge = merge
+        self.write = write
+        self._pending: Dict[Hashable, List[Tuple[Any, V]]] = {}
+        # Syncs flush their own writes, the writes of a target flushed by
+        # concurrent syncs are serialized and the ones older than the last
+        # written version are dropped. The state of a target only lives while
+        # it has writes in flight.
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._writers: Dict[Hashable, int] = {}
+        self._written: Dict[Hashable, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, key: Hashable, value: V, version: Any = 0) -> None:
+        # Pending values are merged by increasing version, so that the final
+        # write does not depend on which concurrent update was queued first.
+        # Versions of a target must therefore be unique, e.g. by ending with
+        # the id of the source of the update.
+        self._pending.setdefault(key, []).append((version, value))
+
+    def flush(self) -> Awaitable[Dict[Hashable, Exception]]:
+        # The pending writes are taken when flush is called rather than when
+        # it is awaited, so that writes queued meanwhile by another sync are
+        # not flushed, and their failures reported, by this one.
+        pending, self._pending = self._pending, {}
+        return self._write(pending)
+
+    async def _write_target(
+            self, key: Hashable, updates: List[Tuple[Any, V]]) -> None:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._writers[key] = self._writers.get(key, 0) + 1
+        try:
+            async with lock:
+                written = self._written.get(key)
+                if written is not None:
+                    updates = [update for update in updates
+                               if update[0] > written]
+                if not updates:
+                    return
+                updates.sort(key=lambda update: update[0])
+                merged = updates[0][1]
+                for _, value in updates[1:]:
+                    merged = self.merge(merged, value)
+                await self.write(merged)
+                self._written[key] = updates[-1][0]
+        finally:
+            self._writers[key] -= 1
+            if not self._writers[key]:
+                del self._writers[key]
+                del self._locks[key]
+                self._written.pop(key, None)
+
+    async def _write(
+            self, pending: Dict[Hashable, List[Tuple[Any, V]]]
+    ) -> Dict[Hashable, Exception]:
+        # A failed write does not prevent the writes of the other targets, the
+        # failures are returned by target key.
+        results = await asyncio.gather(*[
+            self._write_target(key=key, updates=updates)
+            for key, updates in pending.items()], return_exceptions=True)
+        return {
+            key: result
+            for key, result in zip(pending.keys(), results)
+            if isinstance(result, Exception)
+        }